@@ -11,51 +11,121 @@ import type {
 
 export type { DerivativeFunction } from './types'
 
-function solveLinearSystem(A: number[][], b: number[]): number[] {
-  const n = b.length,
-    L = Array.from({ length: n }, () => new Array(n).fill(0)),
-    U = A.map((r) => [...r]),
-    P = Array.from({ length: n }, (_, i) => i)
+/**
+ * Solves the dense n×n system A·x = b in place via LU with partial pivoting.
+ * A is row-major and is overwritten by its packed LU factors; b receives x.
+ */
+function solveLinearSystem(A: Float64Array, b: Float64Array, n: number) {
   for (let i = 0; i < n; i++) {
-    let max = Math.abs(U[i][i]),
+    let max = Math.abs(A[i * n + i]),
       maxR = i
     for (let k = i + 1; k < n; k++)
-      if (Math.abs(U[k][i]) > max) {
-        max = Math.abs(U[k][i])
+      if (Math.abs(A[k * n + i]) > max) {
+        max = Math.abs(A[k * n + i])
         maxR = k
       }
-    const tr = U[i]
-    U[i] = U[maxR]
-    U[maxR] = tr
-    const tp = P[i]
-    P[i] = P[maxR]
-    P[maxR] = tp
-    for (let k = 0; k < i; k++) {
-      const tl = L[i][k]
-      L[i][k] = L[maxR][k]
-      L[maxR][k] = tl
+    if (maxR !== i) {
+      for (let j = 0; j < n; j++) {
+        const t = A[i * n + j]
+        A[i * n + j] = A[maxR * n + j]
+        A[maxR * n + j] = t
+      }
+      const tb = b[i]
+      b[i] = b[maxR]
+      b[maxR] = tb
     }
-    const pV = U[i][i]
-    if (Math.abs(pV) < 1e-18) U[i][i] = pV < 0 ? -1e-18 : 1e-18
+    const pV = A[i * n + i]
+    if (Math.abs(pV) < 1e-18) A[i * n + i] = pV < 0 ? -1e-18 : 1e-18
+    const pivot = A[i * n + i]
     for (let k = i + 1; k < n; k++) {
-      L[k][i] = U[k][i] / U[i][i]
-      for (let j = i; j < n; j++) U[k][j] -= L[k][i] * U[i][j]
+      const l = A[k * n + i] / pivot
+      A[k * n + i] = l
+      for (let j = i + 1; j < n; j++) A[k * n + j] -= l * A[i * n + j]
     }
-    L[i][i] = 1
   }
-  const y = new Array(n).fill(0)
   for (let i = 0; i < n; i++) {
     let s = 0
-    for (let j = 0; j < i; j++) s += L[i][j] * y[j]
-    y[i] = b[P[i]] - s
+    for (let j = 0; j < i; j++) s += A[i * n + j] * b[j]
+    b[i] -= s
   }
-  const x = new Array(n).fill(0)
   for (let i = n - 1; i >= 0; i--) {
     let s = 0
-    for (let j = i + 1; j < n; j++) s += U[i][j] * x[j]
-    x[i] = (y[i] - s) / U[i][i]
+    for (let j = i + 1; j < n; j++) s += A[i * n + j] * b[j]
+    b[i] = (b[i] - s) / A[i * n + i]
+  }
+  return b
+}
+
+/**
+ * Solves the symmetric positive-definite system A·x = b via Cholesky.
+ * Only the lower triangle of A is read and A is left untouched; L receives the
+ * factor and b the solution. Returns false if A is not numerically SPD.
+ */
+function solveCholesky(
+  A: Float64Array,
+  b: Float64Array,
+  n: number,
+  L: Float64Array,
+): boolean {
+  for (let i = 0; i < n; i++) {
+    for (let k = 0; k <= i; k++) {
+      let sum = A[i * n + k]
+      for (let j = 0; j < k; j++) sum -= L[i * n + j] * L[k * n + j]
+      if (k < i) L[i * n + k] = sum / L[k * n + k]
+      else if (sum > 1e-18) L[i * n + i] = Math.sqrt(sum)
+      else return false
+    }
+  }
+  for (let i = 0; i < n; i++) {
+    let s = b[i]
+    for (let j = 0; j < i; j++) s -= L[i * n + j] * b[j]
+    b[i] = s / L[i * n + i]
+  }
+  for (let i = n - 1; i >= 0; i--) {
+    let s = b[i]
+    for (let j = i + 1; j < n; j++) s -= L[j * n + i] * b[j]
+    b[i] = s / L[i * n + i]
+  }
+  return true
+}
+
+interface SchurScratch {
+  dimC: number
+  dimQ: number
+  activeIdx: Int32Array
+  S: Float64Array
+  L: Float64Array
+  JMi: Float64Array
+  rhs: Float64Array
+  D: Float64Array
+  lambda: Float64Array
+  qDdot: Float64Array
+}
+
+// Solver workspace reused across derivative evaluations so the KKT solve does
+// not allocate. Results are copied out before computeDerivatives returns.
+let schurScratch: SchurScratch | null = null
+
+function getSchurScratch(dimC: number, dimQ: number): SchurScratch {
+  if (
+    !schurScratch ||
+    schurScratch.dimC !== dimC ||
+    schurScratch.dimQ !== dimQ
+  ) {
+    schurScratch = {
+      dimC,
+      dimQ,
+      activeIdx: new Int32Array(dimC),
+      S: new Float64Array(dimC * dimC),
+      L: new Float64Array(dimC * dimC),
+      JMi: new Float64Array(dimQ),
+      rhs: new Float64Array(dimC),
+      D: new Float64Array(dimC),
+      lambda: new Float64Array(dimC),
+      qDdot: new Float64Array(dimQ),
+    }
   }
-  return x
+  return schurScratch
 }
 
 export function computeDerivatives(
@@ -158,7 +228,8 @@ export function computeDerivatives(
   )
 
   const cosT = Math.cos(th),
-    sinT = Math.sin(th)
+    sinT = Math.sin(th),
+    dth2 = dth * dth
   const xtl = L1 * cosT,
     ytl = H + L1 * sinT
   const xts = -L2 * cosT,
@@ -167,10 +238,10 @@ export function computeDerivatives(
     ytl_p = L1 * cosT
   const xts_p = L2 * sinT,
     yts_p = -L2 * cosT
-  const xtl_g = -L1 * cosT * dth ** 2,
-    ytl_g = -L1 * sinT * dth ** 2
-  const xts_g = L2 * cosT * dth ** 2,
-    yts_g = L2 * sinT * dth ** 2
+  const xtl_g = -L1 * cosT * dth2,
+    ytl_g = -L1 * sinT * dth2
+  const xts_g = L2 * cosT * dth2,
+    yts_g = L2 * sinT * dth2
 
   const armLength = Math.max(L1 + L2, 1e-12)
   const Ia = (1 / 3) * (Ma / armLength) * (L1 ** 3 + L2 ** 3)
@@ -191,14 +262,11 @@ export function computeDerivatives(
   const rs_x = slingParticles[0] - xtl,
     rs_y = slingParticles[1] - ytl
   const rs2 = Math.max(rs_x * rs_x + rs_y * rs_y, 1e-4)
-  const omega_s_link =
-    (rs_x * (slingVelocities[1] - ytl_p * dth) -
-      rs_y * (slingVelocities[0] - xtl_p * dth)) /
-    rs2
-  const t_s = -getDamping(m_p, Lseg) * (omega_s_link - dth)
-
   const dvx = slingVelocities[0] - xtl_p * dth
   const dvy = slingVelocities[1] - ytl_p * dth
+  const omega_s_link = (rs_x * dvy - rs_y * dvx) / rs2
+  const t_s = -getDamping(m_p, Lseg) * (omega_s_link - dth)
+
   const relVelMag = Math.sqrt(dvx * dvx + dvy * dvy + 1e-12)
   const estimatedTension = m_p * relVelMag * Math.abs(omega_s_link) + m_p * g
   const slingFriction =
@@ -211,10 +279,9 @@ export function computeDerivatives(
   const rcw_x = pCW[0] - xts
   const rcw_y = pCW[1] - yts
   const rcw2 = Math.max(rcw_x * rcw_x + rcw_y * rcw_y, 1e-4)
-  const omega_cw_link =
-    (rcw_x * (vCW[1] - yts_p * dth) - rcw_y * (vCW[0] - xts_p * dth)) / rcw2
   const cwRelVelX = vCW[0] - xts_p * dth
   const cwRelVelY = vCW[1] - yts_p * dth
+  const omega_cw_link = (rcw_x * cwRelVelY - rcw_y * cwRelVelX) / rcw2
   const cwRelVelMag = Math.sqrt(
     cwRelVelX * cwRelVelX + cwRelVelY * cwRelVelY + 1e-12,
   )
@@ -343,65 +410,81 @@ export function computeDerivatives(
     betaSoft * (pN_lock.y - pProj_lock.y)
 
   const cosPhi = Math.cos(phi_cw),
-    sinPhi = Math.sin(phi_cw)
+    sinPhi = Math.sin(phi_cw),
+    dphi_cw2 = dphi_cw * dphi_cw
   const C_cw0 = pCW[0] - (xts + Rcw * sinPhi),
     dC_cw0 = vCW[0] - (xts_p * dth + Rcw * cosPhi * dphi_cw)
   J[N + 2][0] = -xts_p
   J[N + 2][idxCW] = 1.0
   J[N + 2][idxPhi] = -Rcw * cosPhi
   gamma[N + 2] =
-    xts_g - Rcw * sinPhi * dphi_cw ** 2 - alphaHard * dC_cw0 - betaHard * C_cw0
+    xts_g - Rcw * sinPhi * dphi_cw2 - alphaHard * dC_cw0 - betaHard * C_cw0
   const C_cw1 = pCW[1] - (yts - Rcw * cosPhi),
     dC_cw1 = vCW[1] - (yts_p * dth + Rcw * sinPhi * dphi_cw)
   J[N + 3][0] = -yts_p
   J[N + 3][idxCW + 1] = 1.0
   J[N + 3][idxPhi] = -Rcw * sinPhi
   gamma[N + 3] =
-    yts_g + Rcw * cosPhi * dphi_cw ** 2 - alphaHard * dC_cw1 - betaHard * C_cw1
+    yts_g + Rcw * cosPhi * dphi_cw2 - alphaHard * dC_cw1 - betaHard * C_cw1
 
   J[N + 4][idxProj + 1] = 1.0
   gamma[N + 4] = -alphaHard * velocity[1] - betaHard * (position[1] - Rp)
 
+  const scratch = getSchurScratch(dimC, dimQ)
+  const getV = (j: number) => {
+    if (j === 0) return dth
+    if (j < idxProj) return slingVelocities[j - idxSling]
+    if (j < idxCW) return velocity[j - idxProj]
+    if (j < idxPhi) return vCW[j - idxCW]
+    return dphi_cw
+  }
+
   const solveSchur = (mask: boolean[]) => {
-    const activeIdx = mask.map((m, i) => (m ? i : -1)).filter((i) => i !== -1),
-      m = activeIdx.length
-    if (m === 0)
-      return {
-        q_ddot: Q.map((q, i) => q * Minv[i]),
-        lambda: new Float64Array(dimC),
-        check: 0,
-      }
-    const S = Array.from({ length: m }, () => new Array(m).fill(0)),
-      rhs = new Float64Array(m)
+    const { activeIdx, S, L, JMi, rhs, D, qDdot } = scratch,
+      fullLambda = scratch.lambda
+    let m = 0
+    for (let i = 0; i < dimC; i++) if (mask[i]) activeIdx[m++] = i
+    fullLambda.fill(0)
+    if (m === 0) {
+      for (let j = 0; j < dimQ; j++) qDdot[j] = Q[j] * Minv[j]
+      return { q_ddot: qDdot, lambda: fullLambda, check: 0 }
+    }
     const compliance = 1e-7
     for (let i = 0; i < m; i++) {
       const idxA_S = activeIdx[i],
         Ji = J[idxA_S]
       let jm_q = 0
-      for (let j = 0; j < dimQ; j++) jm_q += Ji[j] * Minv[j] * Q[j]
+      for (let j = 0; j < dimQ; j++) {
+        JMi[j] = Ji[j] * Minv[j]
+        jm_q += JMi[j] * Q[j]
+      }
       rhs[i] = jm_q - gamma[idxA_S]
-      for (let k = 0; k < m; k++) {
+      // S is symmetric: fill the lower triangle and mirror it
+      for (let k = 0; k <= i; k++) {
         const Jk = J[activeIdx[k]]
         let sum = 0
-        for (let j = 0; j < dimQ; j++) sum += Ji[j] * Minv[j] * Jk[j]
-        S[i][k] = sum
+        for (let j = 0; j < dimQ; j++) sum += JMi[j] * Jk[j]
+        S[i * m + k] = sum
+        S[k * m + i] = sum
       }
       const slingCompliance = 5e-7
       const actualCompliance = idxA_S < N ? slingCompliance : compliance
-      S[i][i] += actualCompliance
-      const eps_c = Math.max(1e-12, S[i][i] * 1e-9)
-      S[i][i] += eps_c
+      S[i * m + i] += actualCompliance
+      const eps_c = Math.max(1e-12, S[i * m + i] * 1e-9)
+      S[i * m + i] += eps_c
     }
 
-    const D = new Float64Array(m)
-    for (let i = 0; i < m; i++) D[i] = 1.0 / Math.sqrt(Math.max(S[i][i], 1e-18))
+    for (let i = 0; i < m; i++)
+      D[i] = 1.0 / Math.sqrt(Math.max(S[i * m + i], 1e-18))
     for (let i = 0; i < m; i++) {
       rhs[i] *= D[i]
-      for (let j = 0; j < m; j++) S[i][j] *= D[i] * D[j]
+      for (let j = 0; j < m; j++) S[i * m + j] *= D[i] * D[j]
     }
 
-    const solLambdaRaw = solveLinearSystem(S, Array.from(rhs))
-    const fullLambda = new Float64Array(dimC)
+    // S = J·M⁻¹·Jᵀ + compliance is SPD by construction; LU is only a fallback
+    // for when round-off breaks positive-definiteness.
+    if (!solveCholesky(S, rhs, m, L)) solveLinearSystem(S, rhs, m)
+    const solLambdaRaw = rhs
     for (let i = 0; i < m; i++)
       fullLambda[activeIdx[i]] = solLambdaRaw[i] * D[i]
 
@@ -410,27 +493,19 @@ export function computeDerivatives(
       if (mask[i]) {
         let Jqdot = 0
         const Ji = J[i]
-        const getV = (j: number) => {
-          if (j === 0) return dth
-          if (j < idxProj) return slingVelocities[j - idxSling]
-          if (j < idxCW) return velocity[j - idxProj]
-          if (j < idxPhi) return vCW[j - idxCW]
-          return dphi_cw
-        }
         for (let j = 0; j < dimQ; j++) Jqdot += Ji[j] * getV(j)
         checkVal += Jqdot ** 2
       }
     }
 
-    const q_ddot_res = new Float64Array(dimQ)
     for (let j = 0; j < dimQ; j++) {
       let jt_lambda = 0
       for (let i = 0; i < dimC; i++)
         if (mask[i]) jt_lambda += J[i][j] * fullLambda[i]
-      q_ddot_res[j] = Minv[j] * (Q[j] - jt_lambda)
+      qDdot[j] = Minv[j] * (Q[j] - jt_lambda)
     }
     return {
-      q_ddot: q_ddot_res,
+      q_ddot: qDdot,
       lambda: fullLambda,
       check: Math.sqrt(checkVal),
     }